@@ -1,15 +1,41 @@
 import websocket
-import time
+import logging
+import os
+import queue
+from time import monotonic, monotonic_ns
 import ssl
-from threading import Thread
+from threading import Event, Thread
 
 BYTE = {
     'LF': '\x0A',
     'NULL': '\x00'
 }
 
+# frame delimiters used on the send path (BYTE is kept for backward compatibility)
+_LF = b'\x0A'
+_NULL = b'\x00'
+_HEADER_SEP = b':'
+
+# frames that never change within a session are serialized once
+_HEARTBEAT_FRAME = b'\n'
+_DISCONNECT_FRAME = b'DISCONNECT\n\n\x00'
+_SUBSCRIBE_PREFIX = b'SUBSCRIBE\nack:client\nid:'
+_SUBSCRIBE_DESTINATION = b'\ndestination:'
+_SUBSCRIBE_SUFFIX = b'\n\n\x00'
+
+# received MESSAGE frames waiting for their callback; the oldest is dropped when full
+_INBOX_SIZE = 1024
+
+# minimum seconds between two "inbox full" warnings
+_DROP_REPORT_INTERVAL = 5
+
+# heartbeats are sent as pre-masked WebSocket frames, generated in batches of this size
+_HEARTBEAT_POOL_SIZE = 256
+
 VERSIONS = '1.0,1.1'
 
+logger = logging.getLogger(__name__)
+
 class Stomp:
     def __init__(self, host, sockjs=False, wss=True, username=None, password=None, insecure=False, debug=False):
         """
@@ -22,7 +48,7 @@ class Stomp:
             username: Username for authentication
             password: Password for authentication
             insecure: True to accept self-signed certificates (disable SSL verification)
-            debug: True to enable WebSocket debug traces
+            debug: True to enable WebSocket debug traces and log STOMP frames at DEBUG level
         """
         # Enable WebSocket debug traces if requested
         if debug:
@@ -35,58 +61,114 @@ class Stomp:
         self.username = username
         self.password = password
         self.insecure = insecure
+        self.debug = debug
+
+        # set once the server answers CONNECT with a CONNECTED frame
+        self._connected_event = Event()
 
         self.dispatcher = Dispatcher(self)
 
-        # maintain callback registry for subscriptions -> topic (str) vs callback (func)
+        # maintain callback registry for subscriptions -> subscription id (str) vs (destination (str), callback (func), binary (bool))
         self.callback_registry = {}
 
-    def connect(self):
+    @property
+    def connected(self):
+        """
+        True once the STOMP session has been established
+        """
+        return self._connected_event.is_set()
+
+    def connect(self, timeout=30):
         """
         Connect to the remote STOMP server
+
+        Args:
+            timeout: Seconds to wait for the CONNECTED frame
+
+        Returns:
+            True if connected before the timeout expired, False right away if the WebSocket is not open
         """
-        # set flag to false
-        self.connected = False
+        self._connected_event.clear()
+
+        # no point sending CONNECT and waiting on a socket that never opened (or has closed)
+        if not self.dispatcher.opened:
+            print("WebSocket connection is not open, cannot connect to STOMP server")
+            return False
 
         # attempt to connect
         self.dispatcher.connect()
 
         # wait until connected
-        while self.connected is False:
-            time.sleep(.50)
-
-        return self.connected
+        return self._connected_event.wait(timeout=timeout)
 
-    def subscribe(self, destination, callback):
+    def subscribe(self, destination, callback, binary=False):
         """
         Subscribe to a destination and supply a callback that should be executed when a message is received on that destination
+
+        Args:
+            destination: Destination to subscribe to
+            callback: Function called with the body of each message
+            binary: True to receive the body as a memoryview of the raw bytes instead of a str
+
+        Returns:
+            The subscription id
         """
-        # create entry in registry against destination
-        self.callback_registry[destination] = callback
-        self.dispatcher.subscribe(destination)
+        # create entry in registry against the subscription id before any MESSAGE can arrive
+        sub_id = self.dispatcher.new_subscription_id()
+        self.callback_registry[sub_id] = (destination, callback, binary)
+        self.dispatcher.subscribe(destination, sub_id)
+
+        return sub_id
 
     def send(self, destination, message):
         """
         Send a message to a destination
         """
         self.dispatcher.send(destination, message)
+
+    def send_batch(self, destination, messages):
+        """
+        Send several messages to a destination in a single WebSocket message
+        """
+        self.dispatcher.send_batch(destination, messages)
         
     def disconnect(self):
         """
         Disconnect from the STOMP server
         """
-        if hasattr(self, 'connected') and self.connected:
+        if self._connected_event.is_set():
             self.dispatcher.disconnect()
-            self.connected = False
+            self._connected_event.clear()
 
 
 class Dispatcher:
-    def __init__(self, stomp):
+    def __init__(self, stomp, open_timeout=30):
         """
         The Dispatcher handles all network I/O and frame marshalling/unmarshalling
+
+        Args:
+            stomp: Owning Stomp instance
+            open_timeout: Seconds to wait for the WebSocket to open
         """
         self.stomp = stomp
 
+        # set by _on_open once the WebSocket handshake completes
+        self._opened_event = Event()
+
+        # set as soon as the connection attempt has an outcome (opened, errored or closed)
+        self._open_settled_event = Event()
+
+        # pre-masked heartbeat WebSocket frames, refilled by _next_heartbeat when empty
+        self._heartbeat_pool = []
+
+        # callbacks run on a worker thread so slow subscribers do not block WS reads
+        self._inbox = queue.Queue(maxsize=_INBOX_SIZE)
+
+        # messages dropped since the last warning; only touched by the WS reader thread
+        self._dropped = 0
+        self._drop_reported_at = monotonic() - _DROP_REPORT_INTERVAL
+        Thread(target=self._dispatch_loop, daemon=True).start()
+
         self.ws = websocket.WebSocketApp(
             self.stomp.url,
             on_open=self._on_open,
@@ -105,89 +187,178 @@ class Dispatcher:
                 "ssl_version": ssl.PROTOCOL_TLS
             }
 
-        # run event loop on separate thread
-        Thread(target=self.ws.run_forever, kwargs={"ping_interval": 5, "ping_timeout": 4, "sslopt": sslopt}).start()
+        # run event loop on separate thread; skipping UTF-8 validation makes websocket-client
+        # hand text frames over as bytes, which _parse_message decodes piecewise
+        Thread(target=self.ws.run_forever, kwargs={"ping_interval": 5, "ping_timeout": 4, "sslopt": sslopt, "skip_utf8_validation": True}).start()
 
-        self.opened = False
+        # wait until opened or failed; Stomp.connect checks self.opened and fails fast if not open
+        if not self._open_settled_event.wait(timeout=open_timeout):
+            print(f"WebSocket did not open within {open_timeout}s")
 
-        # wait until connected
-        while self.opened is False:
-            time.sleep(.50)
+    @property
+    def opened(self):
+        """
+        True while the WebSocket connection is open
+        """
+        return self._opened_event.is_set()
 
     def _on_message(self, ws, message):
         """
         Executed when messages is received on WS
         """
-        if isinstance(message, bytes):
-            message = message.decode('utf-8')
-        
-        print("<<< " + message)
+        if self.stomp.debug:
+            logger.debug("<<< %s", message.decode('utf-8', 'replace') if isinstance(message, bytes) else message)
 
         command, headers, body = self._parse_message(message)
 
         # if connected, let Stomp know
         if command == "CONNECTED":
-            self.stomp.connected = True
+            self.stomp._connected_event.set()
             print("Successfully connected to STOMP server")
 
         # if error received, log it
         if command == "ERROR":
             print(f"ERROR: {headers.get('message', 'Unknown error')}")
             if body:
-                print(f"Details: {body}")
+                print(f"Details: {str(body, 'utf-8', 'replace')}")
 
         # if message received, call appropriate callback
         if command == "MESSAGE":
+            entry = self.stomp.callback_registry.get(headers.get('subscription'))
+            if entry is None:
+                print(f"Warning: No callback registered for subscription {headers.get('subscription', 'unknown')} (destination {headers.get('destination', 'unknown')})")
+                return
+
+            _, callback, binary = entry
+            self._enqueue((callback, binary, body))
+
+    def _enqueue(self, item):
+        """
+        Queues a message for the dispatch thread, dropping the oldest one if the inbox is full
+
+        Drops are counted and reported at most every _DROP_REPORT_INTERVAL seconds so an
+        overloaded reader is not slowed down further by logging.
+        """
+        while True:
+            try:
+                self._inbox.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._inbox.get_nowait()
+                except queue.Empty:
+                    continue
+
+                self._dropped += 1
+                now = monotonic()
+                if now - self._drop_reported_at >= _DROP_REPORT_INTERVAL:
+                    logger.warning("Inbox full, dropped %d message(s) since the last warning", self._dropped)
+                    self._dropped = 0
+                    self._drop_reported_at = now
+
+    def _dispatch_loop(self):
+        """
+        Runs subscription callbacks for queued messages
+        """
+        while True:
+            callback, binary, body = self._inbox.get()
+
+            # only decode the body for text subscribers; websocket-client no longer validates
+            # UTF-8 (see skip_utf8_validation), so a bad body must not kill this thread
+            if not binary and body is not None:
+                try:
+                    body = str(body, 'utf-8')
+                except UnicodeDecodeError as e:
+                    print(f"Warning: dropped message with a body that is not valid UTF-8: {e}")
+                    continue
+
             try:
-                self.stomp.callback_registry[headers['destination']](body)
-            except KeyError:
-                print(f"Warning: No callback registered for destination {headers.get('destination', 'unknown')}")
+                callback(body)
+            except Exception as e:
+                print(f"Error in subscription callback: {e}")
 
     def _on_error(self, ws, error):
         """
         Executed when WS connection errors out
         """
+        self._open_settled_event.set()
         print(error)
 
     def _on_close(self, ws, close_status_code=None, close_msg=None):
         """
         Executed when WS connection is closed
         """
+        self._opened_event.clear()
+        self._open_settled_event.set()
+
+        # the STOMP session does not survive its WebSocket
+        self.stomp._connected_event.clear()
         print("### closed ###")
 
     def _on_open(self, ws):
         """
         Executed when WS connection is opened
         """
-        self.opened = True
+        self._opened_event.set()
+        self._open_settled_event.set()
 
     def _transmit(self, command, headers, msg=None):
         """
         Marshalls and transmits the frame
         """
-        # Contruct the frame
-        lines = []
-        lines.append(command + BYTE['LF'])
+        self._send(self._marshal(command, headers, msg))
+
+    def _transmit_many(self, frames):
+        """
+        Transmits several marshalled frames as a single WebSocket message
+
+        STOMP frames are delimited by their null octet, so the server parses them independently.
+        """
+        self._send(b''.join(frames))
+
+    def _marshal(self, command, headers, msg=None):
+        """
+        Returns the serialized frame as bytes
+        """
+        return b''.join(self._frame_parts(command, headers, msg))
+
+    @staticmethod
+    def _frame_parts(command, headers, msg):
+        """
+        Yields the frame as a sequence of bytes chunks
+        """
+        # local aliases avoid a global lookup per header
+        lf, sep = _LF, _HEADER_SEP
+
+        # Contruct the frame directly as bytes so websocket-client does not re-encode it
+        yield command.encode('ascii')
+        yield lf
 
         # add headers
-        for key in headers:
-            lines.append(key + ":" + headers[key] + BYTE['LF'])
+        for key, value in headers.items():
+            yield key.encode('ascii')
+            yield sep
+            yield value.encode('utf-8')
+            yield lf
 
-        lines.append(BYTE['LF'])
+        yield lf
 
         # add message, if any
-        if msg is not None:
-            lines.append(msg)
+        if msg:
+            yield msg.encode('utf-8') if isinstance(msg, str) else msg
 
         # terminate with null octet
-        lines.append(BYTE['NULL'])
-    
-        frame = ''.join(lines)
+        yield _NULL
 
+    def _send(self, frame):
+        """
+        Transmits an already serialized frame
+        """
         # transmit over ws
-        print(">>>" + frame)
+        if self.stomp.debug:
+            logger.debug(">>> %s", frame.decode('utf-8', 'replace'))
         try:
-            self.ws.send(frame)
+            self.ws.send(frame, opcode=websocket.ABNF.OPCODE_TEXT)
         except (websocket.WebSocketConnectionClosedException, ConnectionResetError) as e:
             print(f"Error sending message: {e}")
             print("Connection to remote host was lost.")
@@ -198,33 +369,41 @@ class Dispatcher:
         Returns:
             command
             headers
-            body
+            body, as a memoryview into the frame (None if empty)
 
         Args:
-            frame: raw frame string
-        """
-        if isinstance(frame, bytes):
-            frame = frame.decode('utf-8')
-            
-        lines = frame.split(BYTE['LF'])
-
-        command = lines[0].strip()
+            frame: raw frame bytes (str is accepted and encoded first)
+        """
+        if isinstance(frame, str):
+            frame = frame.encode('utf-8')
+
+        # drop the terminating null octet (and any EOLs the server sent after it)
+        end = len(frame)
+        while end and frame[end - 1] == 0x0A:
+            end -= 1
+        if end and frame[end - 1] == 0x00:
+            end -= 1
+
+        # split once into head (command + headers) and body
+        separator = frame.find(b'\n\n', 0, end)
+        if separator < 0:
+            head, body_start = frame[:end], end
+        else:
+            head, body_start = frame[:separator], separator + 2
+        first, _, rest = head.partition(_LF)
+
+        command = first.strip().decode('ascii')
         headers = {}
 
-        # get all headers
-        i = 1
-        while i < len(lines) and lines[i] != '':
-            # get key, value from raw header
-            header_parts = lines[i].split(':', 1)
-            if len(header_parts) == 2:
-                key, value = header_parts
-                headers[key] = value
-            i += 1
-
-        # set body to None if there is no body or index out of range
-        body = None
-        if i + 1 < len(lines):
-            body = None if lines[i+1] == BYTE['NULL'] else lines[i+1]
+        # get all headers; STOMP 1.1 headers are UTF-8, which is a no-op for plain ASCII
+        if rest:
+            for line in rest.split(_LF):
+                key, sep, value = line.partition(_HEADER_SEP)
+                if sep:
+                    headers[key.decode('utf-8')] = value.decode('utf-8')
+
+        # set body to None if there is no body
+        body = memoryview(frame)[body_start:end] if body_start < end else None
 
         return command, headers, body
 
@@ -249,39 +428,58 @@ class Dispatcher:
 
         self._transmit('CONNECT', headers)
 
-    def subscribe(self, destination):
+    def new_subscription_id(self):
         """
-        Transmit a SUBSCRIBE frame
+        Generate a unique subscription ID based on timestamp
         """
-        headers = {}
+        return f"sub-{monotonic_ns():x}-{os.urandom(4).hex()}"
 
-        # Generate a unique ID based on timestamp
-        import time
-        import uuid
-        sub_id = f"sub-{int(time.time())}-{str(uuid.uuid4())[:8]}"
-        
-        headers['id'] = sub_id
-        headers['ack'] = 'client'
-        headers['destination'] = destination
-
-        self._transmit('SUBSCRIBE', headers)
+    def subscribe(self, destination, sub_id):
+        """
+        Transmit a SUBSCRIBE frame
+        """
+        # only the id and destination vary, the rest of the frame is constant
+        self._send(_SUBSCRIBE_PREFIX + sub_id.encode('ascii')
+                   + _SUBSCRIBE_DESTINATION + destination.encode('utf-8')
+                   + _SUBSCRIBE_SUFFIX)
         
     def send(self, destination, message):
         """
         Transmit a SEND frame
         """
+        self._send(self._marshal_send(destination, message))
+
+    def send_batch(self, destination, messages):
+        """
+        Transmit several SEND frames in a single WebSocket message
+        """
+        frames = [self._marshal_send(destination, message) for message in messages]
+
+        # an empty batch would otherwise go out as an empty WebSocket message
+        if not frames:
+            return
+
+        self._transmit_many(frames)
+
+    def _marshal_send(self, destination, message):
+        """
+        Returns a serialized SEND frame
+        """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+
         headers = {}
         headers['destination'] = destination
+        # content-length is expressed in octets, not characters
         headers['content-length'] = str(len(message))
-        
-        self._transmit('SEND', headers, msg=message)
+
+        return self._marshal('SEND', headers, msg=message)
         
     def disconnect(self):
         """
         Transmit a DISCONNECT frame
         """
-        headers = {}
-        self._transmit('DISCONNECT', headers)
+        self._send(_DISCONNECT_FRAME)
         
     def heartbeat(self):
         """
@@ -291,7 +489,29 @@ class Dispatcher:
         Some servers may require an EOL character (BYTE['LF'])
         """
         try:
-            self.ws.send(BYTE['LF'])
+            sock = self.ws.sock
+            if sock is None or not sock.connected:
+                raise websocket.WebSocketConnectionClosedException("socket is already closed.")
+
+            # write the ready-made WebSocket frame, holding the lock websocket-client uses for sends
+            with sock.lock:
+                sock.sock.sendall(self._next_heartbeat())
         except (websocket.WebSocketConnectionClosedException, ConnectionResetError) as e:
             print(f"Error sending heartbeat: {e}")
             print("Connection to remote host was lost.")
+
+    def _next_heartbeat(self):
+        """
+        Returns a masked WebSocket text frame carrying _HEARTBEAT_FRAME
+
+        RFC 6455 requires a fresh mask per client frame, so masks are never reused: the pool
+        is regenerated from a single os.urandom call once it has been used up.
+        """
+        if not self._heartbeat_pool:
+            masks = os.urandom(4 * _HEARTBEAT_POOL_SIZE)
+            self._heartbeat_pool = [
+                # FIN + text opcode, masked payload of length 1, mask key, masked payload
+                b'\x81\x81' + masks[i:i + 4] + bytes((_HEARTBEAT_FRAME[0] ^ masks[i],))
+                for i in range(0, len(masks), 4)
+            ]
+        return self._heartbeat_pool.pop()
@@ -6,18 +6,30 @@ Uses the custom stomp_ws module for STOMP over WebSockets.
 """
 
 import logging
-import time
+from time import sleep
 import json
+import re
 from datetime import datetime
 import argparse
+import functools
 import sys
 import os
+import signal
 import threading
 
 # Add the project root directory to the Python path to find stomp_ws module
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from stomp_ws.stomp import Stomp
 
+# Use orjson for the per-message JSON work when it is installed
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj, indent=2)
+
 # Configure logging (console only, no file)
 logging.basicConfig(
     level=logging.INFO,
@@ -28,25 +40,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def message_handler(message):
+# key=value pairs of the --json payload: split each whitespace-separated token at its first '='
+_KV_RE = re.compile(r'(?<!\S)([^\s=]*)=(\S*)')
+
+# Printed between received messages
+_SEPARATOR = "-" * 80
+
+# Set to stop the consumer loop and the heartbeat thread (e.g. on Ctrl+C)
+_stop_event = threading.Event()
+
+# Seconds between wake-ups of the consumer loop on Windows, bounding Ctrl+C latency
+_WINDOWS_WAIT_INTERVAL = 1
+
+def message_handler(message, pretty=False):
     """
-    Handler for incoming STOMP messages
+    Handler for incoming STOMP messages (the body is already decoded by stomp_ws)
+
+    Args:
+        message: The message body
+        pretty: True to re-indent JSON payloads before logging them
     """
-    if isinstance(message, bytes):
-        message = message.decode('utf-8')
-    
-    timestamp = datetime.now().isoformat()
-    try:
-        # Try to parse as JSON
-        payload = json.loads(message)
-        formatted_payload = json.dumps(payload, indent=2)
-    except json.JSONDecodeError:
-        # If not JSON, use raw message
-        formatted_payload = message
-        
-    logger.info(f"Message received at {timestamp}")
-    logger.info(f"Payload: {formatted_payload}")
-    logger.info("-" * 80)
+    # Nothing to format if the log line would be dropped anyway
+    if not logger.isEnabledFor(logging.INFO):
+        return
+
+    formatted_payload = message
+    if pretty:
+        try:
+            # Try to parse as JSON
+            formatted_payload = _dumps(_loads(message))
+        except (ValueError, TypeError):
+            # If not JSON, use raw message
+            pass
+
+    logger.info("Message received at %s", datetime.now().isoformat())
+    logger.info("Payload: %s", formatted_payload)
+    logger.info("%s", _SEPARATOR)
 
 def parse_args():
     """Parse command-line arguments"""
@@ -60,34 +89,42 @@ def parse_args():
     parser.add_argument('--sockjs', action='store_true', help='Use SockJS protocol')
     parser.add_argument('--send', help='Send a message to the topic and exit (optional)')
     parser.add_argument('--json', action='store_true', help='Format --send payload as JSON (key1=value1 key2=value2)')
+    parser.add_argument('--pretty', action='store_true', help='Pretty-print received JSON payloads')
     parser.add_argument('--heartbeat', type=int, default=10, help='Heartbeat interval in seconds (default: 10)')
     parser.add_argument('--insecure', action='store_true', help='Accept self-signed certificates (disable SSL verification)')
     parser.add_argument('--debug', action='store_true', help='Enable WebSocket debug traces')
     return parser.parse_args()
 
 
+def _coerce(value):
+    """Convert a --json value to int or float when it looks like a number, keep it as a string otherwise"""
+    digits = value[1:] if value[:1] in ('+', '-') else value
+
+    # Fast path for plain integers and decimals
+    if digits.isdecimal():
+        return int(value)
+    if digits.count('.') == 1 and digits.replace('.', '', 1).isdecimal():
+        return float(value)
+
+    # Anything else only converts the way it always did (exponents, 1_000, ...)
+    try:
+        if '.' in value:
+            return float(value)
+        if '_' in value:
+            return int(value)
+    except ValueError:
+        pass
+    return value
+
+
 def format_json_payload(payload):
     """Format a space-separated key=value string into JSON"""
     try:
-        # Parse key=value pairs into a dictionary
-        pairs = [pair.strip() for pair in payload.split()]
-        json_dict = {}
-        for pair in pairs:
-            if '=' in pair:
-                key, value = pair.split('=', 1)
-                # Try to convert to numbers if applicable
-                try:
-                    if '.' in value:
-                        value = float(value)
-                    else:
-                        value = int(value)
-                except ValueError:
-                    pass
-                json_dict[key] = value
-        
+        # Parse key=value pairs into a dictionary, converting numbers if applicable
+        json_dict = {m.group(1): _coerce(m.group(2)) for m in _KV_RE.finditer(payload)}
         return json.dumps(json_dict)
     except Exception as e:
-        logger.error(f"Failed to format as JSON: {str(e)}")
+        logger.error("Failed to format as JSON: %s", e)
         return payload
 
 
@@ -98,20 +135,32 @@ def send_message(client, topic, payload, format_as_json=False):
         logger.info("Converted input to JSON format")
     
     client.send(topic, payload)
-    logger.info(f"Message sent to topic: {topic}")
-    logger.info(f"Payload: {payload}")
-    time.sleep(1)  # Give some time for the message to be delivered
+    logger.info("Message sent to topic: %s", topic)
+    logger.info("Payload: %s", payload)
+    sleep(1)  # Give some time for the message to be delivered
 
 
-def listen_for_messages(client, topic):
+def listen_for_messages(client, topic, pretty=False):
     """Subscribe and listen for messages"""
-    client.subscribe(topic, message_handler)
-    logger.info(f"Subscribed to topic: {topic}")
+    client.subscribe(topic, functools.partial(message_handler, pretty=pretty))
+    logger.info("Subscribed to topic: %s", topic)
     logger.info("Consumer started. Waiting for messages... (Press Ctrl+C to stop)")
     
-    # Keep the main thread alive
-    while True:
-        time.sleep(1)
+    # Stop waiting on Ctrl+C, restoring the previous handler afterwards so a second
+    # Ctrl+C can still interrupt the shutdown
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: _stop_event.set())
+    try:
+        if os.name == 'nt':
+            # On Windows an untimed wait cannot be interrupted, and the handler only runs
+            # once the wait returns, so wake up periodically
+            while not _stop_event.wait(timeout=_WINDOWS_WAIT_INTERVAL):
+                pass
+        else:
+            # Keep the main thread alive without polling
+            _stop_event.wait()
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    logger.info("Shutdown requested by user")
 
 
 def send_heartbeat(client):
@@ -132,25 +181,32 @@ def send_heartbeat(client):
 
 def send_heartbeats(client, interval=10):
     """
-    Start a thread that sends heartbeats periodically
+    Start a thread that sends heartbeats periodically until _stop_event is set
     
     Args:
         client: The STOMP client instance
         interval: Seconds between heartbeats (default: 10)
+
+    Returns:
+        The heartbeat thread, also stored as client.heartbeat_thread
     """
-    logger.info(f"Starting heartbeat thread (interval: {interval}s)")
-    
+    # Only one heartbeat thread per client
+    existing = getattr(client, 'heartbeat_thread', None)
+    if existing is not None and existing.is_alive():
+        return existing
+
+    logger.info("Starting heartbeat thread (interval: %ss)", interval)
+
     def heartbeat_loop():
-        while True:
+        while not _stop_event.wait(interval):
             try:
                 send_heartbeat(client)
-                time.sleep(interval)
             except Exception as e:
-                logger.error(f"Error in heartbeat thread: {str(e)}")
-                time.sleep(interval)
-    
+                logger.error("Error in heartbeat thread: %s", e)
+
     # Start heartbeat thread
     thread = threading.Thread(target=heartbeat_loop, daemon=True)
+    client.heartbeat_thread = thread
     thread.start()
     return thread
 
@@ -159,13 +215,17 @@ def main():
     """Main entry point of the program"""
     args = parse_args()
 
+    # Show the STOMP frame traces emitted by stomp_ws in debug mode
+    if args.debug:
+        logging.getLogger('stomp_ws').setLevel(logging.DEBUG)
+
     # Format host with port
     host_with_port = f"{args.host}:{args.port}"
 
     # Log where we're going to connect to (protocol, host:port and sockjs usage)
     proto = 'wss' if args.ssl else 'ws'
     insecure_msg = " (accepting self-signed certificates)" if args.insecure and args.ssl else ""
-    logger.info(f"Will connect using protocol={proto}, endpoint={host_with_port}, sockjs={args.sockjs}{insecure_msg}")
+    logger.info("Will connect using protocol=%s, endpoint=%s, sockjs=%s%s", proto, host_with_port, args.sockjs, insecure_msg)
 
     # Warning for insecure mode
     if args.insecure and args.ssl:
@@ -182,12 +242,9 @@ def main():
         debug=args.debug
     )
 
-    # Start the heartbeat thread
-    send_heartbeats(client, interval=10)
-
     try:
         # Connect to the STOMP server
-        logger.info(f"Connecting to STOMP server at {'wss' if args.ssl else 'ws'}://{host_with_port}")
+        logger.info("Connecting to STOMP server at %s://%s", proto, host_with_port)
         connected = client.connect()
         
         if connected:
@@ -202,20 +259,20 @@ def main():
                 return
             
             # Otherwise, subscribe and listen
-            listen_for_messages(client, args.topic)
+            listen_for_messages(client, args.topic, pretty=args.pretty)
         else:
             logger.error("Failed to connect to STOMP server")
             
     except KeyboardInterrupt:
         logger.info("Shutdown requested by user")
     except Exception as e:
-        logger.error(f"Error occurred: {str(e)}")
+        logger.error("Error occurred: %s", e)
     finally:
         try:
             client.disconnect()
             logger.info("Disconnected from STOMP server")
         except Exception as e:
-            logger.error(f"Error during disconnect: {str(e)}")
+            logger.error("Error during disconnect: %s", e)
         logger.info("STOMP client shutdown complete")
 
 if __name__ == "__main__":